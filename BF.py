@@ -1,49 +1,271 @@
+import functools
+import itertools
 import math
 from sklearn.utils import murmurhash3_32
-import bitarray
-import random
+import numpy as np
+import xxhash
+
+try:
+    from numba import get_num_threads, njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    # numba is optional: without it the probe loops below run as plain Python
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        def wrap(func):
+            # uint64 wraparound is intended in the probe arithmetic, as it is under numba
+            @functools.wraps(func)
+            def wrapper(*func_args):
+                with np.errstate(over='ignore'):
+                    return func(*func_args)
+            return wrapper
+        if len(args) == 1 and callable(args[0]):
+            return wrap(args[0])
+        return wrap
+
+    prange = range
+
+    def get_num_threads():
+        return 1
 
 # Hash functions
-def hash_factory(m):
+def hash_pair(key):
     """
-    Implement a simple hash function factory. 
-    Given an argument m, the desired hash table size,
-    the factory should return a hash function that maps integers into a table of that length.
-    (Or use murmurhash from sklearn.utils import murmurhash3_32 )
+    Hash a key into the two 32-bit values used to derive all of its probes.
+    String and bytes keys are hashed once with 64-bit xxh3 and split into halves;
+    integer keys use two murmurhash3_32 calls.
 
     input:
-    m: int, the desired hash table size
+    key: int, str or bytes, the key to be hashed
 
     output:
-    hash_function: a hash function that maps integers into a table of length m
+    (h1, h2): two ints in [0, 2^32)
     """
-    def hash_function(key, seed):
-        """
-        input:
-        key: int, the integer to be hashed
-        seed: int, the seed for the hash function
+    if isinstance(key, str):
+        key = key.encode()
+    if isinstance(key, bytes):
+        h = xxhash.xxh3_64_intdigest(key)
+        return h & 0xFFFFFFFF, h >> 32
+    return murmurhash3_32(key, seed=0, positive=True), murmurhash3_32(key, seed=1, positive=True)
+
+
+def hash_many(keys, seed):
+    """
+    Hash a whole batch of integer keys with murmurhash3_32 using a single seed, in one vectorized call.
+    Keys must fit in int32, as for murmurhash3_32 on a single int.
+
+    input:
+    keys: array-like of int, the keys to be hashed
+    seed: int, the seed for the hash function
+
+    output:
+    np.ndarray of uint32, the hash value of every key
+    """
+    keys = np.asarray(keys)
+    # murmurhash3_32 hashes integers as int32; reject wider keys like the scalar call does
+    # instead of letting astype wrap them onto other keys
+    info = np.iinfo(np.int32)
+    if keys.size and (keys.min() < info.min or keys.max() > info.max):
+        raise OverflowError("value too large to convert to int")
+    return murmurhash3_32(keys.astype(np.int32), seed=seed, positive=True)
+
+
+def fastrange(h, n):
+    """
+    Map a 32-bit hash onto [0, n) with Lemire's fastrange, (h * n) >> 32,
+    which needs no division and works for any n, not only powers of two.
+
+    input:
+    h: int or np.ndarray of uint64, 32-bit hash value(s)
+    n: int, the size of the range
+
+    output:
+    int or np.ndarray of uint64, value(s) in [0, n)
+    """
+    if isinstance(h, np.ndarray):
+        return (h * np.uint64(n)) >> np.uint64(32)
+    return (h * n) >> 32
+
+
+def as_key_array(keys):
+    """
+    Convert a batch of keys to an array without changing any key.
+    Integer batches keep their integer dtype; anything else becomes an object array,
+    since fixed-width str/bytes arrays drop trailing NULs and mixed lists would turn ints into strings.
+
+    input:
+    keys: array-like, the keys
+
+    output:
+    np.ndarray of integer or object dtype holding the keys
+    """
+    array = np.asarray(keys)
+    if np.issubdtype(array.dtype, np.integer):
+        return array
+    return np.asarray(keys, dtype=object)
+
+
+def hash_pair_many(keys):
+    """
+    Batched version of hash_pair.
+
+    input:
+    keys: array-like, the keys to be hashed
+
+    output:
+    (h1, h2): two np.ndarrays of uint64 holding 32-bit hash values
+    """
+    keys = as_key_array(keys)
+    if np.issubdtype(keys.dtype, np.integer):
+        return hash_many(keys, 0).astype(np.uint64), hash_many(keys, 1).astype(np.uint64)
+    # hash every key exactly as hash_pair does, so the batched and scalar APIs agree
+    h = np.fromiter((h for key in keys for h in hash_pair(key)), dtype=np.uint64, count=2 * len(keys))
+    return h[0::2], h[1::2]
+
+
+# Probe loops
+# Odd 64-bit golden-ratio constant for multiply-shift hashing of the probes
+PROBE_MIX = 0x9E3779B97F4A7C15
+
+
+@njit(cache=True)
+def _bf_insert(table, h1, h2, k, R):
+    """
+    Set the k probes of a key in a packed uint64 table.
+    Probe i is double hashing followed by multiply-shift, x = ((h1 + i * h2) * PROBE_MIX mod 2^64) >> 32,
+    reduced onto [0, R) with fastrange, (x * R) >> 32.
+
+    input:
+    table: np.ndarray of uint64, the packed bit array
+    h1, h2: int, the two hash values of the key (h2 odd)
+    k: int, the number of probes
+    R: int, the number of bits in the table
+
+    output:
+    None
+    """
+    a = np.uint64(h1)
+    b = np.uint64(h2)
+    for i in range(k):
+        mixed = ((a + np.uint64(i) * b) * np.uint64(PROBE_MIX)) >> np.uint64(32)
+        bit = (mixed * np.uint64(R)) >> np.uint64(32)
+        table[bit >> np.uint64(6)] |= np.uint64(1) << (bit & np.uint64(63))
+
+
+@njit(cache=True)
+def _bf_test(table, h1, h2, k, R):
+    """
+    Check the k probes of a key (see _bf_insert), stopping at the first unset bit.
+
+    input:
+    table: np.ndarray of uint64, the packed bit array
+    h1, h2: int, the two hash values of the key (h2 odd)
+    k: int, the number of probes
+    R: int, the number of bits in the table
+
+    output:
+    bool, whether all k bits are set
+    """
+    a = np.uint64(h1)
+    b = np.uint64(h2)
+    for i in range(k):
+        mixed = ((a + np.uint64(i) * b) * np.uint64(PROBE_MIX)) >> np.uint64(32)
+        bit = (mixed * np.uint64(R)) >> np.uint64(32)
+        if (table[bit >> np.uint64(6)] >> (bit & np.uint64(63))) & np.uint64(1) == 0:
+            return False
+    return True
+
+
+@njit(parallel=True, cache=True)
+def _bf_insert_many(table, h1, h2, k, R, n_shards):
+    """
+    Set the probes (see _bf_insert) of a whole batch of keys, spread over n_shards numba threads.
+    Two threads ORing different bits into the same uint64 word would lose updates,
+    so each thread fills a private copy of the table and the copies are ORed together at the end.
+    With a single shard the keys are scattered straight into the table.
+
+    input:
+    table: np.ndarray of uint64, the packed bit array
+    h1, h2: np.ndarray of uint64, the two hash values of every key (h2 odd)
+    k: int, the number of probes
+    R: int, the number of bits in the table
+    n_shards: int, the number of private tables, at most numba's thread count
+
+    output:
+    None
+    """
+    if n_shards == 1:
+        for j in range(h1.size):
+            _bf_insert(table, h1[j], h2[j], k, R)
+        return
+    shards = np.zeros((n_shards, table.size), dtype=np.uint64)
+    chunk = (h1.size + n_shards - 1) // n_shards
+    for s in prange(n_shards):
+        shard = shards[s]
+        for j in range(s * chunk, min((s + 1) * chunk, h1.size)):
+            _bf_insert(shard, h1[j], h2[j], k, R)
+    for w in prange(table.size):
+        word = table[w]
+        for s in range(n_shards):
+            word |= shards[s, w]
+        table[w] = word
+
+
+def specialize_probes(table, k, R):
+    """
+    Generate insert and test functions for one filter with its k probes unrolled
+    and k, R and the table baked in as constants.
+    Used instead of _bf_insert/_bf_test when numba is not available.
+
+    input:
+    table: np.ndarray of uint64, the packed bit array
+    k: int, the number of probes
+    R: int, the number of bits in the table
+
+    output:
+    (insert, test): functions taking a single key
+    """
+    probes = [f"    bit = (((((h1 + {i} * h2) * {PROBE_MIX}) & {(1 << 64) - 1}) >> 32) * {R}) >> 32\n"
+              for i in range(k)]
+    src = "def insert(key):\n    h1, h2 = hash_pair(key)\n    h2 |= 1\n"
+    src += "".join(probe + "    table[bit >> 6] |= uint64(1 << (bit & 63))\n" for probe in probes)
+    src += "def test(key):\n    h1, h2 = hash_pair(key)\n    h2 |= 1\n"
+    src += "".join(probe + "    if not (int(table[bit >> 6]) >> (bit & 63)) & 1:\n        return False\n"
+                   for probe in probes)
+    src += "    return True\n"
+    namespace = {"hash_pair": hash_pair, "table": table, "uint64": np.uint64}
+    exec(src, namespace)
+    return namespace["insert"], namespace["test"]
 
-        output:
-        int, a hash value
-        """
-        return murmurhash3_32(key, seed=seed) % m
-    return hash_function
 
 # Bloom Filter
 class BloomFilter:
-    def __init__(self, n, fp_rate):
+    # the table size R is rounded up to a multiple of this many bits
+    bits_multiple = 1
+    # keys per scatter pass in insert_many, small enough for the probe arrays to stay in cache
+    insert_chunk = 8192
+    # whether insert/test are replaced by unrolled versions from specialize_probes
+    specialize = not HAVE_NUMBA
+
+    def __init__(self, n, fp_rate, R=None):
         """
         Implement a simple BloomFilter class.
 
         input:
         n: int, the number of elements to be inserted
         fp_rate: float, the desired false positive rate
+        R: int, optional, the number of bits to use instead of the size computed from fp_rate
 
         output:
         None
         """
-        # Calculate the size of the bit array R using the formula: R = -N * ln(fp_rate) / (ln(2)^2)
-        self.R = 1 << math.ceil(math.log2(-n * math.log(fp_rate) / (math.log(2) ** 2)))
+        # Calculate the size of the bit array R (unless given) using the formula: R = -N * ln(fp_rate) / (ln(2)^2)
+        # rounded up only to a multiple of bits_multiple: probes are reduced onto [0, R) with fastrange,
+        # so R no longer has to be a power of two
+        if R is None:
+            R = -n * math.log(fp_rate) / (math.log(2) ** 2)
+        self.R = self.bits_multiple * max(1, math.ceil(R / self.bits_multiple))
 
         # N elements to be inserted
         self.N = n
@@ -52,42 +274,262 @@ class BloomFilter:
         self.fp_rate = fp_rate
 
         # Calculate the number of hash functions (k) using the formula: k = (m / n) * ln(2)
-        self.k = math.ceil((self.R / self.N) * math.log(2))
+        self.k = max(1, round((self.R / self.N) * math.log(2)))
+
+        # create a bit array of size R, packed into ceil(R / 64) uint64 words
+        self.table = np.zeros((self.R + 63) >> 6, dtype=np.uint64)
+
+        if self.specialize:
+            self.insert, self.test = specialize_probes(self.table, self.k, self.R)
 
-        # create a bit array of size R
-        self.table = bitarray.bitarray(self.R)
-        self.table.setall(0)
+    @property
+    def nbytes(self):
+        """
+        Memory used by the bit array, in bytes.
 
-        # Create k hash functions
-        self.hash_functions = [hash_factory(self.R) for _ in range(self.k)]
+        input:
+        None
+
+        output:
+        int, the size of the bit table in bytes
+        """
+        return self.table.nbytes
 
     def insert(self, key):
         """
         Insert a key into the Bloom filter.
 
         input:
-        key: int, the integer to be inserted
+        key: int, str or bytes, the key to be inserted
 
         output:
         None
         """
-        for i in range(self.k):
-            self.table[self.hash_functions[i](key, i)] = 1
+        h1, h2 = hash_pair(key)
+        _bf_insert(self.table, h1, h2 | 1, self.k, self.R)
+
+    def test(self, key):
+        """
+        Test if a key is in the Bloom filter.
+
+        input:
+        key: int, str or bytes, the key to be tested
+
+        output:
+        bool, whether the key is in the Bloom filter
+        """
+        h1, h2 = hash_pair(key)
+        return bool(_bf_test(self.table, h1, h2 | 1, self.k, self.R))
+
+    def probes_many(self, keys):
+        """
+        Compute the k probe indices of every key in a batch with double hashing
+        and multiply-shift, matching _bf_insert.
+
+        input:
+        keys: array-like, the keys to be hashed
+
+        output:
+        np.ndarray of uint64 with shape (len(keys), k), the table indices probed by each key
+        """
+        h1, h2 = hash_pair_many(keys)
+        h2 |= np.uint64(1)
+        steps = np.arange(self.k, dtype=np.uint64)
+        probes = h1[:, None] + steps * h2[:, None]
+        probes *= np.uint64(PROBE_MIX)
+        probes >>= np.uint64(32)
+        return fastrange(probes, self.R)
+
+    def insert_many(self, keys):
+        """
+        Insert a batch of keys into the Bloom filter.
+        With numba the keys are hashed up front and ingested in parallel by _bf_insert_many.
+        Otherwise they are processed insert_chunk at a time so the probe, word and bit arrays
+        of each pass are still cache-resident when they are scattered into the table.
+
+        input:
+        keys: array-like, the keys to be inserted
+
+        output:
+        None
+        """
+        keys = as_key_array(keys)
+        if HAVE_NUMBA:
+            h1, h2 = hash_pair_many(keys)
+            # a private shard costs a zeroed copy and a merge of the whole table, so only use
+            # as many as the batch has bits to set, i.e. at least one table's worth per shard
+            n_shards = min(get_num_threads(), max(1, len(h1) * self.k // self.table.size))
+            _bf_insert_many(self.table, h1, h2 | np.uint64(1), self.k, self.R, n_shards)
+            return
+        for start in range(0, len(keys), self.insert_chunk):
+            probes = self.probes_many(keys[start:start + self.insert_chunk]).ravel()
+            np.bitwise_or.at(self.table, probes >> np.uint64(6), np.uint64(1) << (probes & np.uint64(63)))
+
+    def test_many(self, keys):
+        """
+        Test a batch of keys against the Bloom filter.
+
+        input:
+        keys: array-like, the keys to be tested
+
+        output:
+        np.ndarray of bool, whether each key is in the Bloom filter
+        """
+        probes = self.probes_many(keys)
+        bits = (self.table[probes >> np.uint64(6)] >> (probes & np.uint64(63))) & np.uint64(1)
+        return bits.astype(bool).all(axis=1)
+
+
+# Blocked Bloom Filter
+# 32-bit golden-ratio multiplier used to derive the in-block probe positions
+BLOCK_REMIX = 0x9E3779B9
+
+
+@njit(cache=True)
+def _blocked_insert(block, h2, k):
+    """
+    Set the k probes of a key inside its 512-bit block.
+    Each probe remixes h2 by a multiply (as in RocksDB's FastLocalBloom)
+    and takes the top 9 bits as the bit position inside the block.
+
+    input:
+    block: np.ndarray of uint64, the 8 words of the key's block
+    h2: int, the second hash value of the key
+    k: int, the number of probes
+
+    output:
+    None
+    """
+    for _ in range(k):
+        h2 = (h2 * BLOCK_REMIX) & 0xFFFFFFFF
+        bit = h2 >> 23
+        block[bit >> 6] |= np.uint64(1 << (bit & 63))
+
+
+@njit(cache=True)
+def _blocked_test(block, h2, k):
+    """
+    Check the k probes of a key (see _blocked_insert), stopping at the first unset bit.
+
+    input:
+    block: np.ndarray of uint64, the 8 words of the key's block
+    h2: int, the second hash value of the key
+    k: int, the number of probes
+
+    output:
+    bool, whether all k bits are set
+    """
+    for _ in range(k):
+        h2 = (h2 * BLOCK_REMIX) & 0xFFFFFFFF
+        bit = h2 >> 23
+        if not (int(block[bit >> 6]) >> (bit & 63)) & 1:
+            return False
+    return True
+
+
+class BlockedBloomFilter(BloomFilter):
+    # one block is a 64-byte cache line
+    block_bits = 512
+    bits_multiple = block_bits
+    specialize = False
+
+    def __init__(self, n, fp_rate, R=None):
+        """
+        Implement a blocked (cache-local) Bloom filter.
+        The bit array is split into 512-bit blocks; h1 picks the block of a key
+        and all k probes of that key land inside it, so each lookup touches one cache line.
+
+        input:
+        n: int, the number of elements to be inserted
+        fp_rate: float, the desired false positive rate
+        R: int, optional, the number of bits to use (rounded up to whole blocks)
+
+        output:
+        None
+        """
+        super().__init__(n, fp_rate, R)
+
+        # View the table as rows of 8 uint64 words, one row per block
+        self.n_blocks = self.R // self.block_bits
+        self.blocks = self.table.reshape(self.n_blocks, self.block_bits // 64)
+
+    def insert(self, key):
+        """
+        Insert a key into the Bloom filter.
+
+        input:
+        key: int, str or bytes, the key to be inserted
+
+        output:
+        None
+        """
+        h1, h2 = hash_pair(key)
+        _blocked_insert(self.blocks[fastrange(h1, self.n_blocks)], h2, self.k)
 
     def test(self, key):
         """
         Test if a key is in the Bloom filter.
 
         input:
-        key: int, the integer to be tested
+        key: int, str or bytes, the key to be tested
 
         output:
         bool, whether the key is in the Bloom filter
         """
+        h1, h2 = hash_pair(key)
+        return bool(_blocked_test(self.blocks[fastrange(h1, self.n_blocks)], h2, self.k))
+
+    def masks_many(self, keys):
+        """
+        Compute the block of every key in a batch and its k probes as a 512-bit mask,
+        so that testing a key is a single (block & mask) == mask comparison.
+
+        input:
+        keys: array-like, the keys to be hashed
+
+        output:
+        block: np.ndarray of uint64 with shape (len(keys),), the block index of each key
+        masks: np.ndarray of uint64 with shape (len(keys), 8), the bits each key sets in its block
+        """
+        h1, h2 = hash_pair_many(keys)
+        block = fastrange(h1, self.n_blocks)
+        words = self.block_bits // 64
+        masks = np.zeros(len(block) * words, dtype=np.uint64)
+        rows = np.arange(len(block), dtype=np.uint64) * np.uint64(words)
+        # probe i uses h2 * BLOCK_REMIX^(i+1) mod 2^32, matching the scalar loop
         for i in range(self.k):
-            if not self.table[self.hash_functions[i](key, i)]:
-                return False
-        return True
+            remix = np.uint64(pow(BLOCK_REMIX, i + 1, 1 << 32))
+            bit = ((h2 * remix) & np.uint64(0xFFFFFFFF)) >> np.uint64(23)
+            masks[rows + (bit >> np.uint64(6))] |= np.uint64(1) << (bit & np.uint64(63))
+        return block, masks.reshape(len(block), words)
+
+    def insert_many(self, keys):
+        """
+        Insert a batch of keys into the Bloom filter by ORing each key's mask into its block.
+
+        input:
+        keys: array-like, the keys to be inserted
+
+        output:
+        None
+        """
+        keys = as_key_array(keys)
+        for start in range(0, len(keys), self.insert_chunk):
+            block, masks = self.masks_many(keys[start:start + self.insert_chunk])
+            np.bitwise_or.at(self.blocks, block, masks)
+
+    def test_many(self, keys):
+        """
+        Test a batch of keys against the Bloom filter.
+
+        input:
+        keys: array-like, the keys to be tested
+
+        output:
+        np.ndarray of bool, whether each key is in the Bloom filter
+        """
+        block, masks = self.masks_many(keys)
+        return np.all((self.blocks[block] & masks) == masks, axis=1)
 
 
 def generate_membership_test_set():
@@ -100,21 +542,21 @@ def generate_membership_test_set():
     None
     
     output:
-    membership_set: set, a set of 10,000 random integers between 10,000 and 100,000
+    membership_set: np.ndarray, 10,000 unique random integers between 10,000 and 100,000
+    test_set_all: np.ndarray, 2000 unique integers, half of them from membership_set
     """
-    membership_list = random.sample(range(10000, 100000), 10000)
-    
-    membership_set = set(membership_list)
-    
-    test_set1 = set(random.sample(membership_list, 1000))
+    rng = np.random.default_rng()
+    universe = np.arange(10000, 100000)
 
-    available_set = set(range(10000, 100000)) - membership_set
+    membership_set = rng.choice(universe, size=10000, replace=False)
+    
+    test_set1 = rng.choice(membership_set, size=1000, replace=False)
 
-    available_list = list(available_set)
+    available_set = np.setdiff1d(universe, membership_set, assume_unique=True)
     
-    test_set2 = set(random.sample(available_list, 1000))
+    test_set2 = rng.choice(available_set, size=1000, replace=False)
     
-    test_set_all = test_set1.union(test_set2)
+    test_set_all = np.concatenate((test_set1, test_set2))
     
     return membership_set, test_set_all
 
@@ -124,23 +566,21 @@ def demonstrate_bloom_filter():
     membership_set, test_set = generate_membership_test_set()
     result = ""
 
-    for fp_rate in false_positive_rates:
-        bloom_filter = BloomFilter(len(membership_set), fp_rate)
+    non_members = ~np.isin(test_set, membership_set)
+
+    for fp_rate, filter_class in itertools.product(false_positive_rates, (BloomFilter, BlockedBloomFilter)):
+        bloom_filter = filter_class(len(membership_set), fp_rate)
             
         # Insert all items in the membership set into the Bloom filter
-        for item in membership_set:
-            bloom_filter.insert(item)
+        bloom_filter.insert_many(membership_set)
             
         # Test all items in the test set and compute the false positive rate
-        false_positives = 0
-        for item in test_set:
-            if item not in membership_set and bloom_filter.test(item):
-                false_positives += 1
+        false_positives = int(np.count_nonzero(bloom_filter.test_many(test_set) & non_members))
             
         actual_fp_rate = false_positives / len(test_set)
-        print(f"Desired FP rate: {fp_rate}, Actual FP rate: {actual_fp_rate}")
+        print(f"{filter_class.__name__}: Desired FP rate: {fp_rate}, Actual FP rate: {actual_fp_rate}")
 
-        result += f"Desired FP rate: {fp_rate}, Actual FP rate: {actual_fp_rate}\n"
+        result += f"{filter_class.__name__}: Desired FP rate: {fp_rate}, Actual FP rate: {actual_fp_rate}\n"
     
     with open("Results.txt", "w") as f:
         f.write(result)
@@ -1,14 +1,17 @@
 import csv
+import math
+import numpy as np
 import pandas as pd
-import random
 import string
 import sys
-from BF import BloomFilter, hash_factory
+from BF import BloomFilter
 import matplotlib.pyplot as plt
 
 # Initialize Bloom filter
 data  = pd.read_csv('../user-ct-test-collection-01.txt', sep='\t')
 urllist = data.ClickURL.dropna().unique() # the membership query set
+# UTF-8 encode every URL once up front so the filters hash bytes directly
+url_bytes = np.array([url.encode() for url in urllist], dtype=object)
 
 # Initialize variables
 N = 377871
@@ -18,8 +21,7 @@ memory_usages = []
 # Initialize Bloom filter
 bloom_filter = BloomFilter(n=N, fp_rate=0.01)
 # Add URLs to Bloom filter
-for url in urllist:
-    bloom_filter.insert(url)
+bloom_filter.insert_many(url_bytes)
 
 
 def sample_1000_urls(urllist):
@@ -27,20 +29,25 @@ def sample_1000_urls(urllist):
     Sample 1000 URLs from the URL list and generate 1000 false URLs.
 
     input:
-    urllist: list, a list of URLs
+    urllist: np.ndarray, the array of URLs
 
     output:
-    test_urls: list, a list of 1000 URLs sampled from the URL list
+    test_urls: np.ndarray, 1000 URLs sampled from the URL list
     false_urls: list, a list of 1000 false URLs
     """
-    test_urls = random.sample(list(urllist), 1000)
-    false_urls = [''.join(random.choices(string.ascii_letters + string.digits, k=10)) for _ in range(1000)]
+    rng = np.random.default_rng()
+    # Sample straight from the URL array without copying it into a list
+    test_urls = rng.choice(urllist, size=1000, replace=False)
+    # Draw all 1000 x 10 characters in one call and slice the bytes into strings
+    alphabet = np.frombuffer((string.ascii_letters + string.digits).encode(), dtype=np.uint8)
+    raw = alphabet[rng.integers(0, len(alphabet), size=(1000, 10))].tobytes()
+    false_urls = [raw[i * 10:(i + 1) * 10].decode() for i in range(1000)]
     return test_urls, false_urls
 
 
 # Function to calculate false positive rate
 def calculate_false_positive_rate(bloom_filter : BloomFilter, false_urls):
-    false_positives = sum(1 for url in false_urls if bloom_filter.test(url))
+    false_positives = int(bloom_filter.test_many(false_urls).sum())
     return false_positives / len(false_urls)
 
 
@@ -59,35 +66,52 @@ def compare_with_hashtable(urllist, bloom_filter):
     # Insert URLs into a Python hashtable (set)
     hashtable = set(urllist)
         
-    # Calculate memory usage of the hashtable
-    hashtable_memory_usage = sys.getsizeof(hashtable)
+    # Calculate memory usage of the hashtable, counting the URL strings it references as well as the set itself
+    hashtable_memory_usage = sys.getsizeof(hashtable) + sum(sys.getsizeof(url) for url in hashtable)
         
-    # Estimate the size of the Bloom filter using theoretical bit calculations
-    m = - (N * R_values[-1]) / (N * (1 - (1 - 1 / N) ** (N * R_values[-1])))
-    estimated_bloom_filter_size = m / 8  # Convert bits to bytes
+    # Estimate the size of the Bloom filter using the optimal size formula: m = -N * ln(fp_rate) / (ln(2)^2)
+    estimated_bloom_filter_size_bits = math.ceil(-bloom_filter.N * math.log(bloom_filter.fp_rate) / (math.log(2) ** 2))
+    estimated_bloom_filter_size = estimated_bloom_filter_size_bits / 8  # Convert bits to bytes
         
     # Compare memory usage
     print(f"Memory Usage of Hashtable: {hashtable_memory_usage} bytes")
     print(f"Estimated Memory Usage of Bloom Filter: {estimated_bloom_filter_size:.2f} bytes")
-    print(f"Actual Memory Usage of Bloom Filter: {sys.getsizeof(bloom_filter)} bytes")
+    print(f"Actual Memory Usage of Bloom Filter: {bloom_filter.nbytes} bytes")
 
     # Comment on findings
-    if hashtable_memory_usage > sys.getsizeof(bloom_filter):
+    if hashtable_memory_usage > bloom_filter.nbytes:
         print("The Bloom filter uses less memory than the hashtable.")
     else:
         print("The hashtable uses less memory than the Bloom filter.")
 
 
 
+def fp_rate_for_bits(R, n):
+    """
+    Invert R = -n * ln(fp_rate) / (ln(2)^2) to get the nominal fp_rate of a Bloom filter with R bits.
+    This only fills in the filter's fp_rate attribute; its size comes from passing R to BloomFilter.
+
+    input:
+    R: int, the desired number of bits
+    n: int, the number of elements to be inserted
+
+    output:
+    float, the corresponding false positive rate
+    """
+    return math.exp(-R * math.log(2) ** 2 / n)
+
+
 def main():
     test_urls, false_urls = sample_1000_urls(urllist)
     for R in R_values:
-        k = int(0.7 * R / N)
-        fpr = calculate_false_positive_rate(bloom_filter, false_urls)
+        # Rebuild the filter at this size and re-ingest the URLs
+        sized_filter = BloomFilter(n=N, fp_rate=fp_rate_for_bits(R, N), R=R)
+        sized_filter.insert_many(url_bytes)
+        fpr = calculate_false_positive_rate(sized_filter, false_urls)
         false_positive_rates.append(fpr)
-        memory_usage = sys.getsizeof(bloom_filter)
+        memory_usage = sized_filter.nbytes
         memory_usages.append(memory_usage)
-        print(f"R: {R}, k: {k}, False Positive Rate: {fpr}, Memory Usage: {memory_usage} bytes")
+        print(f"R: {sized_filter.R}, k: {sized_filter.k}, False Positive Rate: {fpr}, Memory Usage: {memory_usage} bytes")
     plt.plot(memory_usages, false_positive_rates, marker='o')
     plt.xlabel('Memory Usage (bytes)')
     plt.ylabel('False Positive Rate')